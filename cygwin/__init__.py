@@ -2,27 +2,35 @@
 """High-level Python wrappers for Cygwin API functions."""
 
 
-try:
-    __version__ = \
-        __import__('pkg_resources').get_distribution('PyCygwin').version
-except:
-    __version__ = ''
-
-
+import contextlib
+import functools
 import os
-import sys
+import threading
 
 from . import _cygwin
 
 
-PY2 = sys.version_info[0] == 2
-if PY2:
-    text_type = unicode
-else:
-    text_type = str
+__all__ = ['cygpath', 'cygpath_many', 'winpid_to_pid', 'pid_to_winpid',
+           'pids_to_winpids', 'oneshot', 'pid_snapshot', 'pid_cache_clear']
+
+
+def __getattr__(name):
+    # __version__ is looked up lazily, since importing the package metadata
+    # is slow, especially on Cygwin; once found it is stored as a module
+    # global so that later lookups do not go through __getattr__ again
+    if name == '__version__':
+        from importlib.metadata import version, PackageNotFoundError
 
+        try:
+            ver = version('PyCygwin')
+        except PackageNotFoundError:
+            return ''
 
-__all__ = ['cygpath', 'winpid_to_pid', 'pid_to_winpid']
+        globals()['__version__'] = ver
+        return ver
+
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
 
 
 def cygpath(path, mode='unix', absolute=True):
@@ -88,37 +96,153 @@ def cygpath(path, mode='unix', absolute=True):
         '.../q/DOES_NOT_EXIST'
         >>> pth == os.path.join(cygdrive, 'q/DOES_NOT_EXIST')
         True
+
+    Notes
+    -----
+    Conversions of absolute paths are memoized, since the same paths tend to
+    be converted over and over again.  A memoized result becomes stale if the
+    Cygwin mount table is changed, or if a symlink along the path is
+    retargeted or removed, while the process is running; call
+    ``cygpath.cache_clear()`` to discard any stale results.  Forked child
+    processes inherit the parent's memoized results, so the same applies to
+    changes made before the fork.  Relative paths depend on the current
+    working directory, and paths under ``/proc`` (e.g. ``/proc/self/...``)
+    depend on the calling process, so those are always converted anew outside
+    of a `oneshot` block.
+    """
+
+    if not isinstance(path, (str, bytes)):
+        path = str(path)
+
+    absolute = bool(absolute)
+
+    if _isabs(path) and not _isproc(path):
+        return _cygpath_cached(path, mode, absolute)
+
+    cache = _oneshot.cache
+    if cache is None:
+        return _cygwin.cygpath(path, mode, absolute)
+
+    key = (path, mode, absolute)
+    try:
+        return cache[key]
+    except KeyError:
+        result = cache[key] = _cygwin.cygpath(path, mode, absolute)
+        return result
+
+
+# Arguments are validated by _cygwin.cygpath, and invalid arguments raise an
+# exception so they are never cached
+_cygpath_cached = functools.lru_cache(maxsize=4096)(_cygwin.cygpath)
+
+
+cygpath.cache_clear = _cygpath_cached.cache_clear
+
+
+class _OneshotState(threading.local):
+    """
+    Per-thread state of `oneshot`: the conversions of relative paths
+    memoized within the thread's `oneshot` block, or `None` outside of one.
     """
 
-    supported_modes = {
-        'u': 'unix',
-        'w': 'windows'
-    }
+    cache = None
 
-    if (not mode or mode[0] not in supported_modes or
-            (len(mode) > 1 and mode != supported_modes[mode[0]])):
-        raise ValueError("mode must be one of " +
-                ' '.join("'{}'/'{}'".format(item)
-                         for item in sorted(supported_modes.items())))
 
-    mode = supported_modes[mode[0]]
+_oneshot = _OneshotState()
 
-    if not isinstance(path, (text_type, bytes)):
-        path = text_type(path)
 
-    char_width = 'W' if isinstance(path, text_type) else 'A'
+@contextlib.contextmanager
+def oneshot():
+    """
+    Context manager within which `cygpath` also memoizes conversions of
+    relative paths.
+
+    Outside this context only absolute paths are memoized, since relative
+    paths are resolved against the current working directory.  Within it,
+    the working directory is assumed not to change, so converting a batch of
+    relative paths repeatedly only calls into Cygwin once per distinct path.
+    The memoized relative paths are discarded upon exiting the outermost
+    `oneshot` block.  Memoization only applies to the thread that entered
+    the block.
+
+    Examples
+    --------
+
+    >>> import cygwin
+    >>> with cygwin.oneshot():
+    ...     winpath = cygwin.cygpath('foo', 'w')
+    ...     cygwin.cygpath('foo', 'w') == winpath
+    True
+    """
 
-    if mode == 'unix':
-        what = getattr(_cygwin, 'CCP_WIN_{}_TO_POSIX'.format(char_width))
-    else:
-        what = getattr(_cygwin, 'CCP_POSIX_TO_WIN_{}'.format(char_width))
+    state = _oneshot
 
-    if absolute:
-        what |= _cygwin.CCP_ABSOLUTE
-    else:
-        what |= _cygwin.CCP_RELATIVE
+    if state.cache is not None:
+        # Already in a oneshot() block in this thread
+        yield
+        return
 
-    return _cygwin.conv_path(what, path)
+    state.cache = {}
+    try:
+        yield
+    finally:
+        state.cache = None
+
+
+def _isabs(path):
+    """
+    Returns `True` if the given POSIX or Windows path is absolute, i.e. its
+    conversion does not depend on the current working directory.
+    """
+
+    if isinstance(path, bytes):
+        path = path.decode('latin-1')
+
+    return (path[:1] == '/' or path[:2] == '\\\\' or
+            path[1:3] in (':/', ':\\'))
+
+
+def _isproc(path):
+    """
+    Returns `True` if the given path is under ``/proc``, whose contents
+    depend on the calling process.
+    """
+
+    if isinstance(path, bytes):
+        path = path.decode('latin-1')
+
+    return path == '/proc' or path.startswith('/proc/')
+
+
+def cygpath_many(paths, mode='unix', absolute=True):
+    r"""
+    Converts each path in ``paths`` like `cygpath` and returns a list of the
+    converted paths in the same order.
+
+    This is much faster than calling `cygpath` in a loop when converting
+    many paths, as the conversion loop runs entirely in the ``_cygwin``
+    extension module.  Results are not memoized.
+
+    Parameters
+    ----------
+    paths : iterable of `str` or path-like
+        The paths to convert.  These may be all `str` (or path-like) or all
+        `bytes`, but not a mix of the two.
+    mode : `str`, optional
+        Same as for `cygpath`.
+    absolute : `bool`, optional
+        Same as for `cygpath`.
+
+    Examples
+    --------
+
+    >>> import cygwin
+    >>> cyg_root = cygwin.cygpath('/', 'w')
+    >>> print(cygwin.cygpath_many([cyg_root, cyg_root + '\\usr']))
+    ['/', '/usr']
+    """
+
+    return _cygwin.cygpath_many(paths, mode, absolute)
 
 
 def winpid_to_pid(pid):
@@ -134,6 +258,10 @@ def winpid_to_pid(pid):
         The PID of a Windows process to look up in Cygwin.
     """
 
+    cached = _pid_snapshot.winpid_to_pid
+    if cached is not None:
+        return cached(pid)
+
     return _cygwin.winpid_to_pid(pid)
 
 
@@ -149,4 +277,129 @@ def pid_to_winpid(pid):
         The PID of a Cygwin process to convert.
     """
 
-    return _cygwin.internal(_cygwin.CW_CYGWIN_PID_TO_WINPID, pid)
+    global _self_winpid
+
+    if pid == _self_pid:
+        if _self_winpid is None:
+            _self_winpid = _cygwin.pid_to_winpid(pid)
+        return _self_winpid
+
+    cached = _pid_snapshot.pid_to_winpid
+    if cached is not None:
+        return cached(pid)
+
+    return _cygwin.pid_to_winpid(pid)
+
+
+def pids_to_winpids(pids):
+    """
+    Converts the PIDs of several Cygwin processes to their native Windows
+    PIDs, returning a list of the results in the same order.
+
+    This is faster than calling `pid_to_winpid` in a loop, as the loop runs
+    entirely in the ``_cygwin`` extension module.  Results are not cached,
+    even within a `pid_snapshot` block.
+
+    Raises ``OSError(ESRCH, ...)`` if no process exists for any of the PIDs.
+
+    Parameters
+    ----------
+    pids : iterable of `int`
+        The PIDs of the Cygwin processes to convert.
+
+    Examples
+    --------
+
+    >>> import os, cygwin
+    >>> pid = os.getpid()
+    >>> cygwin.pids_to_winpids([pid, pid]) == [cygwin.pid_to_winpid(pid)] * 2
+    True
+    """
+
+    return _cygwin.pids_to_winpids(pids)
+
+
+class _PIDSnapshotState(threading.local):
+    """
+    Per-thread state of `pid_snapshot`.
+
+    PIDs are eventually reused, so the caches only exist while the thread is
+    inside a `pid_snapshot` block; lookups of nonexistent PIDs raise and are
+    not cached.
+    """
+
+    depth = 0
+    winpid_to_pid = None
+    pid_to_winpid = None
+
+
+_pid_snapshot = _PIDSnapshotState()
+
+
+# The Windows PID of the current process never changes, so it is looked up at
+# most once; a forked child is a new process, so it must look up its own
+_self_pid = os.getpid()
+_self_winpid = None
+
+
+def _reset_self_pid():
+    global _self_pid, _self_winpid
+    _self_pid = os.getpid()
+    _self_winpid = None
+
+
+os.register_at_fork(after_in_child=_reset_self_pid)
+
+
+def pid_cache_clear():
+    """
+    Clears the results cached by `winpid_to_pid` and `pid_to_winpid` within
+    the current thread's `pid_snapshot` block.
+
+    This can be used within a long-running `pid_snapshot` block, for example
+    after observing that a child process has exited.  Outside of a
+    `pid_snapshot` block this does nothing.
+    """
+
+    if _pid_snapshot.depth:
+        _pid_snapshot.winpid_to_pid.cache_clear()
+        _pid_snapshot.pid_to_winpid.cache_clear()
+
+
+@contextlib.contextmanager
+def pid_snapshot():
+    """
+    Context manager within which the results of `winpid_to_pid` and
+    `pid_to_winpid` are cached.
+
+    This speeds up code which repeatedly translates the same PIDs, such as
+    when walking a process tree.  The cache is discarded upon exiting the
+    outermost `pid_snapshot` block, since once a process exits its PID may be
+    reused by another process.  Caching only applies to the thread that
+    entered the block.
+
+    Examples
+    --------
+
+    >>> import os, cygwin
+    >>> with cygwin.pid_snapshot():
+    ...     winpid = cygwin.pid_to_winpid(os.getpid())
+    ...     cygwin.pid_to_winpid(os.getpid()) == winpid
+    True
+    """
+
+    state = _pid_snapshot
+
+    if not state.depth:
+        state.winpid_to_pid = functools.lru_cache(maxsize=1024)(
+            _cygwin.winpid_to_pid)
+        state.pid_to_winpid = functools.lru_cache(maxsize=1024)(
+            _cygwin.pid_to_winpid)
+
+    state.depth += 1
+    try:
+        yield
+    finally:
+        state.depth -= 1
+        if not state.depth:
+            state.winpid_to_pid = state.pid_to_winpid = None
@@ -1,11 +1,12 @@
 """Low-level wrappers around ``<sys/cygwin.h>`` functions."""
 
 import locale
-import sys
 
 from cpython.bytes cimport PyBytes_FromStringAndSize, PyBytes_AS_STRING
+from cpython.mem cimport PyMem_RawFree, PyMem_RawMalloc, PyMem_RawRealloc
 from cpython.unicode cimport PyUnicode_Decode
-from libc.errno cimport errno, ENOSYS, ESRCH
+from libc.errno cimport errno, ENOSPC, ENOSYS, ESRCH
+from libc.stddef cimport wchar_t
 from libc.string cimport strerror, strlen
 
 
@@ -14,20 +15,39 @@ cdef extern from "Python.h":
     char* PyUnicode_AsUTF8(object s)
 
 
+cdef extern from "<limits.h>":
+    enum: PATH_MAX
+
+
+# Size in bytes of the on-stack output buffers for cygwin_conv_path(); large
+# enough for any path of up to PATH_MAX characters, including wide paths
+cdef enum:
+    CONV_BUF_SIZE = PATH_MAX * 2
+
+
+cdef extern from "<wchar.h>" nogil:
+    size_t wcslen(const wchar_t* s)
+
+
+cdef unicode MODE_ERROR = u"mode must be one of 'u'/'unix' 'w'/'windows'"
+
+
 cdef inline strerror_as_str(int err):
     """
-    Wrapper for ``strerror`` that returns the correct `str` type for the
-    current Python version.
+    Wrapper for ``strerror`` that returns a `str` decoded with the preferred
+    encoding of the current locale.
     """
 
-    IF PY_MAJOR_VERSION == 2:
-        return strerror(err)
-    ELSE:
-        cdef const char* s
-        cdef const char* enc
-        s = strerror(err)
-        enc = PyUnicode_AsUTF8(locale.getpreferredencoding(False))
-        return PyUnicode_Decode(s, strlen(s), enc, "ignore")
+    cdef const char* s
+    cdef const char* enc
+    s = strerror(err)
+    enc = PyUnicode_AsUTF8(locale.getpreferredencoding(False))
+    return PyUnicode_Decode(s, strlen(s), enc, "ignore")
+
+
+# Message for the common case of looking up a nonexistent PID, so it does not
+# have to be looked up and decoded each time
+cdef unicode ESRCH_MESSAGE = strerror_as_str(ESRCH)
 
 
 def conv_path(what, path):
@@ -89,49 +109,203 @@ def conv_path(what, path):
         True
     """
 
+    return conv_path_c(what, path)
+
+
+cdef conv_path_c(cygwin_conv_path_t what, path):
+    # Most paths fit in the stack buffer, so that cygwin_conv_path() need only
+    # be called once; conv_path_buf moves to the heap if they don't
+    cdef char stack_buf[CONV_BUF_SIZE]
+    cdef char* buf = stack_buf
+    cdef size_t bufsize = CONV_BUF_SIZE
+
+    try:
+        return conv_path_buf(what, path, &buf, &bufsize, stack_buf)
+    finally:
+        if buf != stack_buf:
+            PyMem_RawFree(buf)
+
+
+def conv_path_many(what, paths):
+    """
+    Like `conv_path` but converts every path in the iterable ``paths`` with
+    the same ``what`` flags, returning a list of the converted paths.
+
+    All paths must be either unicode strings or bytes; they may not be mixed.
+    A single output buffer is reused for all conversions, and is only grown
+    if a converted path does not fit in it.
+    """
+
+    cdef cygwin_conv_path_t c_what = what
+    cdef char stack_buf[CONV_BUF_SIZE]
+    cdef char* buf = stack_buf
+    cdef size_t bufsize = CONV_BUF_SIZE
+    cdef list out = []
+    cdef int wide = -1
+
+    try:
+        for path in paths:
+            if wide < 0:
+                wide = isinstance(path, unicode)
+            elif isinstance(path, unicode) != wide:
+                raise TypeError("can't mix unicode and bytes paths")
+
+            out.append(conv_path_buf(c_what, path, &buf, &bufsize,
+                                     stack_buf))
+    finally:
+        if buf != stack_buf:
+            PyMem_RawFree(buf)
+
+    return out
+
+
+cpdef cygpath(path, mode=u'unix', bint absolute=True):
+    """
+    Implementation of `cygwin.cygpath`; see its documentation for details.
+
+    This handles validating the arguments and determining the ``what`` flags
+    for ``cygwin_conv_path()``, but does not memoize its results.
+    """
+
+    cdef cygwin_conv_path_t what
+
+    if not isinstance(path, (unicode, bytes)):
+        path = unicode(path)
+
+    what = resolve_what(mode, isinstance(path, unicode), absolute)
+    return conv_path_c(what, path)
+
+
+def cygpath_many(paths, mode=u'unix', bint absolute=True):
+    """
+    Implementation of `cygwin.cygpath_many`; see its documentation for
+    details.
+    """
+
+    cdef cygwin_conv_path_t what
+    cdef list c_paths = [
+        path if isinstance(path, (unicode, bytes)) else unicode(path)
+        for path in paths
+    ]
+
+    # The mode is validated even if there are no paths to convert
+    what = resolve_what(mode, not c_paths or isinstance(c_paths[0], unicode),
+                        absolute)
+
+    if not c_paths:
+        return []
+
+    return conv_path_many(what, c_paths)
+
+
+cdef inline int resolve_what(mode, bint wide, bint absolute) except -1:
+    """
+    Returns the ``what`` flags for ``cygwin_conv_path()`` corresponding to
+    the ``mode`` and ``absolute`` arguments of `cygpath`, for a unicode
+    (``wide``) or bytes path.
+    """
+
+    cdef int what
+    cdef Py_ssize_t n = 0
+    cdef Py_UCS4 m = 0
+
+    if isinstance(mode, unicode):
+        n = len(<unicode>mode)
+        if n:
+            m = (<unicode>mode)[0]
+
+    if m == u'u' and (n == 1 or mode == u'unix'):
+        what = CCP_WIN_W_TO_POSIX if wide else CCP_WIN_A_TO_POSIX
+    elif m == u'w' and (n == 1 or mode == u'windows'):
+        what = CCP_POSIX_TO_WIN_W if wide else CCP_POSIX_TO_WIN_A
+    else:
+        raise ValueError(MODE_ERROR)
+
+    return what | (CCP_ABSOLUTE if absolute else CCP_RELATIVE)
+
+
+cdef inline bytes encode_path(cygwin_conv_path_t mode, path):
+    """
+    Encodes a unicode path to the bytes expected by ``cygwin_conv_path()``
+    for the given conversion mode.
+    """
+
+    if mode == CCP_WIN_W_TO_POSIX:
+        # Need to append an additional null byte for proper UTF-16
+        # termination
+        return path.encode('utf-16-le') + b'\x00'
+    else:
+        # TODO: Should this really use UTF-8, or should it be based on the
+        # current locale and/or code page?  Not clear at the moment.
+        return path.encode('utf-8')
+
+
+cdef conv_path_buf(cygwin_conv_path_t what, path, char** buf,
+                   size_t* bufsize, char* stack_buf):
+    """
+    Converts ``path`` into the caller-owned buffer ``*buf`` of ``*bufsize``
+    bytes, and returns the result as the same string type as ``path``.
+
+    If the result does not fit, ``*buf`` is replaced with a larger buffer
+    allocated with ``PyMem_RawMalloc``, which the caller must free if it is
+    no longer ``stack_buf``.
+    """
+
+    cdef cygwin_conv_path_t mode = what & CCP_CONVTYPE_MASK
     cdef ssize_t size
-    cdef bytes to
-    cdef int decode = 0
-
-    # & out other modifiers to the "what" argument to get the basic
-    # conversion mode
-    mode = what & 0xff
-
-    if isinstance(path, unicode):
-        if mode == CCP_WIN_W_TO_POSIX:
-            # Need to append an additional null byte for proper UTF-16
-            # termination
-            path = path.encode('utf-16-le') + b'\x00'
-        else:
-            # TODO: Should this really use UTF-8, or should it be based on the
-            # current locale and/or code page?  Not clear at the moment.
-            path = path.encode('utf-8')
-        decode = 1
-
-    size = cygwin_conv_path(what, PyBytes_AS_STRING(path), NULL, 0)
-    if size < 0:
-        raise OSError(errno, strerror_as_str(errno), path)
-
-    to = PyBytes_FromStringAndSize("", size)
-
-    size = cygwin_conv_path(what, PyBytes_AS_STRING(path),
-                            PyBytes_AS_STRING(to), size)
-    if size < 0:
-        raise OSError(errno, strerror_as_str(errno), path)
+    cdef char* newbuf
+    cdef bint decode = isinstance(path, unicode)
+    cdef bytes b_path
+    cdef const char* c_path
 
     if decode:
-        if mode == CCP_POSIX_TO_WIN_W:
-            return to.decode('utf-16-le')[:-1]
-        else:
-            return to.decode('utf-8')[:-1]
+        b_path = encode_path(mode, path)
+    elif isinstance(path, bytes):
+        # Copy bytes subclasses to exact bytes objects
+        b_path = path if type(path) is bytes else bytes(path)
+    else:
+        raise TypeError(
+            'path must be str or bytes, not {}'.format(type(path).__name__))
+
+    c_path = b_path
+
+    # The conversion itself does not touch any Python objects, so release
+    # the GIL to allow paths to be converted in parallel from several threads
+    with nogil:
+        size = cygwin_conv_path(what, c_path, buf[0], bufsize[0])
+        if size < 0 and errno == ENOSPC:
+            # Ask for the required size so that the buffer can be grown
+            size = cygwin_conv_path(what, c_path, NULL, 0)
+            if size >= 0:
+                if buf[0] == stack_buf:
+                    newbuf = <char*>PyMem_RawMalloc(size)
+                else:
+                    newbuf = <char*>PyMem_RawRealloc(buf[0], size)
+                if newbuf == NULL:
+                    size = -2
+                else:
+                    buf[0] = newbuf
+                    bufsize[0] = size
+                    size = cygwin_conv_path(what, c_path, buf[0], bufsize[0])
+
+    if size == -2:
+        raise MemoryError()
+    elif size < 0:
+        raise OSError(errno, strerror_as_str(errno), b_path)
 
     if mode == CCP_POSIX_TO_WIN_W:
-        return to[:-2]
+        size = wcslen(<wchar_t*>buf[0]) * sizeof(wchar_t)
+        if decode:
+            return buf[0][:size].decode('utf-16-le')
+        return PyBytes_FromStringAndSize(buf[0], size)
 
-    return to[:-1]
+    size = strlen(buf[0])
+    if decode:
+        return buf[0][:size].decode('utf-8')
+    return PyBytes_FromStringAndSize(buf[0], size)
 
 
-def winpid_to_pid(pid):
+cpdef winpid_to_pid(int winpid):
     """
     Converts the native Windows PID of a Cygwin process to its Cygwin PID.
 
@@ -139,13 +313,46 @@ def winpid_to_pid(pid):
     `OSError` if the PID does not exist, or does not map to a Cygwin PID.
     """
 
-    pid = cygwin_winpid_to_pid(pid)
+    cdef pid_t pid = cygwin_winpid_to_pid(winpid)
     if pid < 0:
         raise OSError(errno, strerror_as_str(errno))
 
     return pid
 
 
+cpdef pid_to_winpid(pid_t pid):
+    """
+    Converts the PID of a Cygwin process to its native Windows PID.
+
+    This is the same as ``internal(CW_CYGWIN_PID_TO_WINPID, pid)`` but
+    without the overhead of dispatching on the ``cygwin_internal()`` method.
+    Raises ``OSError(ESRCH, ...)`` if no process with the given PID exists.
+    """
+
+    cdef pid_t winpid = <pid_t>cygwin_internal(CW_CYGWIN_PID_TO_WINPID, pid)
+    if not winpid:
+        raise OSError(ESRCH, ESRCH_MESSAGE)
+
+    return winpid
+
+
+def pids_to_winpids(pids):
+    """
+    Converts each PID in ``pids`` to its native Windows PID, as with
+    `pid_to_winpid`, returning a list of the results.
+
+    Raises ``OSError(ESRCH, ...)`` if no process exists for one of the PIDs.
+    """
+
+    cdef pid_t pid
+    cdef list out = []
+
+    for pid in pids:
+        out.append(pid_to_winpid(pid))
+
+    return out
+
+
 def internal(cygwin_getinfo_types t, *args):
     """
     Wrapper for the workhorse ``cygwin_internal()`` function, which provides
@@ -189,13 +396,9 @@ def internal(cygwin_getinfo_types t, *args):
                 'cygwin_internal(CW_CYGWIN_PID_TO_WINPID, ...) takes exactly 1 '
                 'argument ({} given)'.format(len(args)))
 
-        ret = <pid_t>cygwin_internal(t, <pid_t>pid)
-        if not ret:
-            errno = ESRCH
+        ret = pid_to_winpid(pid)
 
-    if errno:
-        raise OSError(errno, strerror_as_str(errno))
-    elif ret is None:
+    if ret is None:
         raise OSError(ENOSYS, strerror_as_str(ENOSYS))
 
     return ret
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import glob
+import hashlib
 import json
 import os
 import time
@@ -7,9 +9,11 @@ import sys
 
 from distutils import log
 from distutils.command.build_ext import build_ext as _build_ext
+from distutils.dep_util import newer_group
 from distutils.errors import DistutilsModuleError, DistutilsOptionError
 
 from setuptools import setup, Command, Extension
+from setuptools.command.sdist import sdist as _sdist
 
 class build_cython(Command):
     description = "compile Cython extensions into C/C++ extensions"
@@ -22,10 +26,13 @@ class build_cython(Command):
         ('parallel=', 'j',
          "run cythonize in parallel with N processes"),
         ('force=', 'f',
-         "force files to be cythonized even if the are not changed")
+         "force files to be cythonized even if the are not changed"),
+        ('inplace', 'i',
+         "generate C sources next to the Cython sources, as shipped in "
+         "source distributions")
     ]
 
-    boolean_options = ['debug', 'profile', 'force']
+    boolean_options = ['debug', 'profile', 'force', 'inplace']
 
     def initialize_options(self):
         self.extensions = None
@@ -38,7 +45,9 @@ class build_cython(Command):
         self.profile = None
         self.parallel = None
         self.force = None
+        self.inplace = None
 
+        self.pregenerated_sources = None
         self.cython_directives = None
         self.compile_time_env = None
 
@@ -72,7 +81,11 @@ class build_cython(Command):
             log.info('Enabling Cython profiling support')
 
         if self.parallel is None:
-            self.parallel = 0
+            # Cythonize in parallel by default, but do not start more worker
+            # processes than there are extensions to cythonize; starting
+            # processes is particularly expensive on Cygwin
+            self.parallel = min(os.cpu_count() or 1,
+                                max(len(self.extensions), 1))
 
         try:
             self.parallel = int(self.parallel)
@@ -82,67 +95,118 @@ class build_cython(Command):
         try:
             import Cython
         except ImportError:
-            raise DistutilsModuleError(
-                "Cython must be installed and importable in order to run "
-                "the cythonize command")
+            # Source distributions ship the C sources generated by Cython, so
+            # they can still be built without Cython as long as those are
+            # not out of date (and --force was not given)
+            if not self.force and not self.inplace:
+                self.pregenerated_sources = self._find_pregenerated_sources()
+
+            if self.pregenerated_sources is None:
+                raise DistutilsModuleError(
+                    "Cython must be installed and importable in order to run "
+                    "the cythonize command")
+
+            return
 
         # Cython compiler directives
         self.cython_directives = dict(
             auto_pickle=False,
             autotestdict=False,
+            binding=False,
             cdivision=True,
             embedsignature=True,
             fast_getattr=True,
+            initializedcheck=False,
+            language_level=3,
             profile=self.profile,
         )
 
-        self.compile_time_env = dict(
-            PY_MAJOR_VERSION=sys.version_info[0]
-        )
+        self.compile_time_env = dict()
+
+        if self.inplace:
+            # The version file only describes the C sources in build_dir,
+            # which an in-place run does not touch; always regenerate the
+            # in-place sources instead
+            self.force = True
+            return
 
         # We check the Cython version and some relevant configuration
         # options from the earlier build to see if we need to force a
         # recythonization. If the version or options have changed, we
         # must recythonize all files.
-        self._version_file = os.path.join(self.build_dir, '.cython_version')
-        self._version_stamp = json.dumps({
+        # The digest of the relevant configuration is stored in the name of
+        # the version file, so checking it only requires a stat() call
+        version_stamp = hashlib.blake2b(json.dumps({
             'version': Cython.__version__,
             'debug': self.debug,
             'directives': self.cython_directives,
             'compile_time_env': self.compile_time_env
-        }, sort_keys=True)
-
-        # Read an already written version file if it exists and compare to the
-        # current version stamp
-        try:
-            if open(self._version_file).read() == self._version_stamp:
-                force = False
-            else:
-                # version_file exists but its contents are not what we
-                # want => recythonize all Cython code.
-                force = True
-                # In case this cythonization is interrupted, we end up
-                # in an inconsistent state with C code generated by
-                # different Cython versions or with different options.
-                # To ensure that this inconsistent state will be fixed,
-                # we remove the version_file now to force a
-                # recythonization the next time we build Sage.
-                os.unlink(self._version_file)
-        except IOError:
-            # Most likely, the version_file does not exist
-            # => (re)cythonize all Cython code.
+        }, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+        self._version_file = os.path.join(
+            self.build_dir, '.cython_version.' + version_stamp)
+
+        if os.path.exists(self._version_file):
+            force = False
+        else:
+            # Either there is no version file or it is for a different
+            # version or options => recythonize all Cython code.
             force = True
+            # In case this cythonization is interrupted, we end up
+            # in an inconsistent state with C code generated by
+            # different Cython versions or with different options.
+            # To ensure that this inconsistent state will be fixed,
+            # we remove any old version_file now to force a
+            # recythonization the next time we build.
+            old_files = glob.glob(
+                os.path.join(self.build_dir, '.cython_version*'))
+            for old_file in old_files:
+                os.unlink(old_file)
 
         # If the --force flag was given at the command line, always force;
         # otherwise use what we determined from reading the version file
         if self.force is None:
             self.force = force
 
+    def _find_pregenerated_sources(self):
+        """
+        Returns the list of sources for each extension with its Cython
+        sources replaced by the pregenerated C sources next to them, or
+        `None` if any of those are missing or older than their Cython
+        sources.
+        """
+
+        all_sources = []
+
+        for ext in self.extensions:
+            sources = []
+            for source in ext.sources:
+                base, source_ext = os.path.splitext(source)
+                if source_ext == '.pyx':
+                    depends = [source]
+                    if os.path.exists(base + '.pxd'):
+                        depends.append(base + '.pxd')
+                    source = base + '.c'
+                    if newer_group(depends, source):
+                        return None
+                sources.append(source)
+            all_sources.append(sources)
+
+        return all_sources
+
     def run(self):
         """
         Call ``cythonize()`` to replace the ``ext_modules`` with the
         extensions containing Cython-generated C code.
         """
+        if self.pregenerated_sources is not None:
+            log.warn("Cython is not installed; using the pregenerated C "
+                     "sources as-is, so Cython options such as --profile "
+                     "are ignored")
+            for ext, sources in zip(self.extensions,
+                                    self.pregenerated_sources):
+                ext.sources = sources
+            return
+
         from Cython.Build import cythonize
         import Cython.Compiler.Options
 
@@ -150,19 +214,20 @@ class build_cython(Command):
 
         log.info("Updating Cython code....")
         t = time.time()
+        # With --inplace, the C sources are written next to the Cython
+        # sources
+        build_dir = None if self.inplace else self.build_dir
         extensions = cythonize(
             self.extensions,
             nthreads=self.parallel,
-            build_dir=self.build_dir,
+            build_dir=build_dir,
             force=self.force,
             compiler_directives=self.cython_directives,
             compile_time_env=self.compile_time_env,
             # Debugging
             gdb_debug=self.debug,
-            output_dir=self.build_dir,
-            # Disable Cython caching, which is currently too broken to
-            # use reliably: http://trac.sagemath.org/ticket/17851
-            cache=False,
+            output_dir=build_dir,
+            cache=os.path.join(self.build_dir, 'cython_cache'),
             )
 
         for ext in extensions:
@@ -176,8 +241,26 @@ class build_cython(Command):
         log.info("Finished Cythonizing, time: {:.2f} seconds.".format(
             (time.time() - t)))
 
-        with open(self._version_file, 'w') as f:
-            f.write(self._version_stamp)
+        if not self.inplace:
+            open(self._version_file, 'w').close()
+
+
+class sdist(_sdist):
+    """
+    Same as the default sdist command, but first regenerates the C sources
+    for the Cython extensions next to the Cython sources, so that they are
+    included in the source distribution and installing from it does not
+    require Cython.
+    """
+
+    def run(self):
+        build_cython = self.reinitialize_command('build_cython')
+        build_cython.inplace = True
+        build_cython.force = True
+        build_cython.debug = False
+        self.run_command('build_cython')
+
+        _sdist.run(self)
 
 
 class build_ext(_build_ext):
@@ -196,13 +279,15 @@ class build_ext(_build_ext):
 
 
 EXT_MODULES = [
-    Extension('cygwin._cygwin', [os.path.join('cygwin', '_cygwin.pyx')])
+    Extension('cygwin._cygwin', [os.path.join('cygwin', '_cygwin.pyx')],
+              extra_compile_args=['-O3'])
 ]
 
 
 CMDCLASS = {
     'build_cython': build_cython,
-    'build_ext': build_ext
+    'build_ext': build_ext,
+    'sdist': sdist
 }
 
 
@@ -227,6 +312,7 @@ setup(
     long_description=readme(),
     license='BSD',
     packages=['cygwin'],
+    python_requires='>=3.8',
     ext_modules=EXT_MODULES,
     cmdclass=CMDCLASS
 )